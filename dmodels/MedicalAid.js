@@ -15,7 +15,9 @@ const medicalAidSchema = new mongoose.Schema({
     },
     coordinates: {
         lat: Number,
-        lng: Number
+        lng: Number,
+        // 'gazetteer' when only the centre of the named place is known
+        source: String
     },
     contactNumber: {
         type: String,
@@ -33,6 +35,16 @@ const medicalAidSchema = new mongoose.Schema({
         default: 'medium'
     },
     additionalInfo: String,
+    // Indexed below by the unique partial index alone; a plain path index would
+    // share its key and stop the unique one from being built
+    incidentId: {
+        type: String
+    },
+    // True for the one request per incident that notifies volunteers
+    incidentLead: {
+        type: Boolean,
+        default: false
+    },
     status: {
         type: String,
         enum: ['pending', 'assigned', 'in-progress', 'completed', 'cancelled'],
@@ -48,4 +60,9 @@ const medicalAidSchema = new mongoose.Schema({
     }
 });
 
+medicalAidSchema.index(
+    { incidentId: 1 },
+    { name: 'incidentId_lead', unique: true, partialFilterExpression: { incidentLead: true } }
+);
+
 module.exports = mongoose.model('MedicalAid', medicalAidSchema);
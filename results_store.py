@@ -0,0 +1,190 @@
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    request_id TEXT UNIQUE NOT NULL,
+    created_at REAL NOT NULL,
+    request_type TEXT COLLATE NOCASE,
+    location TEXT COLLATE NOCASE,
+    condition TEXT COLLATE NOCASE,
+    urgency TEXT COLLATE NOCASE,
+    patient_name TEXT,
+    incident_id TEXT,
+    lat REAL,
+    lng REAL,
+    transcription TEXT,
+    form_data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_time ON results (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_results_location ON results (location, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_results_condition ON results (condition, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_results_urgency ON results (urgency, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_results_type ON results (request_type, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_results_incident ON results (incident_id, created_at, id);
+"""
+
+INSERT = """
+INSERT OR REPLACE INTO results (
+    request_id, created_at, request_type, location, condition, urgency,
+    patient_name, incident_id, lat, lng, transcription, form_data
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Query parameter -> indexed column
+FILTER_COLUMNS = {
+    "type": "request_type",
+    "location": "location",
+    "condition": "condition",
+    "urgency": "urgency",
+    "incident_id": "incident_id"
+}
+
+
+class ResultsStore:
+    """SQLite (WAL mode) store of transcriptions and extracted form data.
+
+    ``add`` only enqueues the row; a single writer thread drains the queue and
+    commits rows in batches, so request handlers never wait on disk. Readers
+    use their own per-thread connections, which WAL lets run alongside the
+    writer. Queries page with a (created_at, id) cursor so deep pages cost
+    the same as the first one.
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="results-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+        logger.info(f"Results store ready at: {path}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def add(self, request_id, request_type, transcription, form_data, created_at=None):
+        """Queue one processed request for writing"""
+        coordinates = form_data.get("coordinates") or {}
+        self._queue.put((
+            request_id,
+            time.time() if created_at is None else created_at,
+            request_type,
+            form_data.get("location"),
+            form_data.get("condition"),
+            form_data.get("urgency"),
+            form_data.get("patientName"),
+            form_data.get("incidentId"),
+            coordinates.get("lat"),
+            coordinates.get("lng"),
+            transcription,
+            json.dumps(form_data)
+        ))
+
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            rows = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Gather whatever else is already waiting into the same transaction
+            while True:
+                if item is None:
+                    running = False
+                else:
+                    rows.append(item)
+                if len(rows) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if not rows:
+                continue
+            try:
+                with conn:
+                    conn.executemany(INSERT, rows)
+                logger.info(f"Stored {len(rows)} results")
+            except sqlite3.Error as e:
+                logger.error(f"Failed to store {len(rows)} results: {str(e)}")
+        conn.close()
+
+    def close(self):
+        """Flush queued rows and stop the writer thread"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=10)
+
+    def query(self, filters=None, since=None, until=None, limit=50, cursor=None):
+        """Return (rows, next_cursor), newest first.
+
+        ``filters`` maps keys of FILTER_COLUMNS to exact (case-insensitive)
+        values; ``since``/``until`` are epoch seconds; ``cursor`` is the
+        ``next_cursor`` returned by the previous page.
+        """
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            if value:
+                clauses.append(f"{FILTER_COLUMNS[key]} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if cursor:
+            created_at, row_id = cursor.split(":", 1)
+            clauses.append("(created_at, id) < (?, ?)")
+            params.extend([float(created_at), int(row_id)])
+
+        sql = "SELECT id, request_id, created_at, request_type, transcription, form_data FROM results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1][2]!r}:{rows[-1][0]}"
+
+        return [
+            {
+                "request_id": request_id,
+                "created_at": created_at,
+                "type": request_type,
+                "transcription": transcription,
+                "form_data": json.loads(form_data)
+            }
+            for _, request_id, created_at, request_type, transcription, form_data in rows
+        ], next_cursor
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
@@ -43,6 +43,9 @@ mongoose.connect(mongoURI)
         
         // Fix the problematic email index in volunteers collection
         fixVolunteerEmailIndex();
+        
+        // Seed the speech service's spatial index with every available volunteer
+        loadVolunteerIndex();
     })
     .catch(err => {
         console.error('Could not connect to MongoDB:', err);
@@ -154,35 +157,147 @@ function findKNearestNeighbors(volunteers, targetLocation, k = 5) {
   return volunteersWithDistance.slice(0, k);
 }
 
+// Spatial index of volunteer positions kept by the Python speech service
+const SPEECH_SERVICE_URL = process.env.SPEECH_SERVICE_URL || 'http://localhost:5000';
+const SPEECH_SERVICE_TIMEOUT_MS = 2000;
+const VOLUNTEER_INDEX_BATCH_SIZE = 1000;
+const VOLUNTEER_INDEX_RETRY_MS = 30 * 1000;
+let lastVolunteerIndexLoad = 0;
+
+// Index entry for a volunteer, or null if they should not be matchable by position
+function volunteerIndexEntry(volunteer) {
+  const coordinates = volunteer.location && volunteer.location.coordinates;
+  if (!volunteer.availability || !Array.isArray(coordinates) || coordinates.length !== 2) {
+    return null;
+  }
+  return { id: volunteer._id.toString(), lat: coordinates[1], lng: coordinates[0] };
+}
+
+// Mirror one volunteer's current position and availability into the index
+async function syncVolunteerIndex(volunteer) {
+  const entry = volunteerIndexEntry(volunteer);
+  try {
+    const response = entry
+      ? await fetch(`${SPEECH_SERVICE_URL}/api/volunteers/locations`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(entry),
+          signal: AbortSignal.timeout(SPEECH_SERVICE_TIMEOUT_MS)
+        })
+      : await fetch(`${SPEECH_SERVICE_URL}/api/volunteers/locations/${volunteer._id}`, {
+          method: 'DELETE',
+          signal: AbortSignal.timeout(SPEECH_SERVICE_TIMEOUT_MS)
+        });
+    if (!response.ok && response.status !== 404) {
+      console.error(`Volunteer index sync for ${volunteer._id} failed with status ${response.status}`);
+    }
+  } catch (error) {
+    console.error(`Volunteer index sync for ${volunteer._id} failed:`, error.message);
+  }
+}
+
+// Bulk-load all available volunteers; retried while the speech service is down
+async function loadVolunteerIndex() {
+  lastVolunteerIndexLoad = Date.now();
+  try {
+    const volunteers = await Volunteer.find(
+      { availability: true, 'location.coordinates.1': { $exists: true } },
+      { location: 1, availability: 1 }
+    ).lean();
+    const entries = volunteers.map(volunteerIndexEntry).filter(Boolean);
+
+    for (let i = 0; i < entries.length; i += VOLUNTEER_INDEX_BATCH_SIZE) {
+      const response = await fetch(`${SPEECH_SERVICE_URL}/api/volunteers/locations`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(entries.slice(i, i + VOLUNTEER_INDEX_BATCH_SIZE)),
+        signal: AbortSignal.timeout(SPEECH_SERVICE_TIMEOUT_MS * 5)
+      });
+      if (!response.ok) throw new Error(`status ${response.status}`);
+    }
+    console.log(`Loaded ${entries.length} volunteers into the spatial index`);
+  } catch (error) {
+    console.error('Failed to load volunteer spatial index, retrying later:', error.message);
+    setTimeout(loadVolunteerIndex, VOLUNTEER_INDEX_RETRY_MS);
+  }
+}
+
+// k nearest available volunteers from the spatial index, or null if it cannot answer
+async function findIndexedNearestVolunteers(location, k) {
+  try {
+    const params = new URLSearchParams({ lat: location.lat, lng: location.lng, k });
+    const response = await fetch(`${SPEECH_SERVICE_URL}/api/volunteers/nearest?${params}`, {
+      signal: AbortSignal.timeout(SPEECH_SERVICE_TIMEOUT_MS)
+    });
+    const result = await response.json();
+    if (!response.ok || !result.success) {
+      console.error('Spatial index query failed:', result.message);
+      return null;
+    }
+
+    // An empty index means the speech service restarted; reload it in the background
+    if (result.indexed === 0) {
+      if (Date.now() - lastVolunteerIndexLoad > VOLUNTEER_INDEX_RETRY_MS) {
+        loadVolunteerIndex();
+      }
+      return null;
+    }
+
+    const distances = new Map(result.volunteers.map(v => [v.id, v.distance]));
+    const volunteers = await Volunteer.find({
+      _id: { $in: [...distances.keys()] },
+      availability: true
+    }).lean();
+
+    return volunteers
+      .map(volunteer => ({ ...volunteer, distance: distances.get(volunteer._id.toString()) }))
+      .sort((a, b) => a.distance - b.distance);
+  } catch (error) {
+    console.error('Spatial index unavailable:', error.message);
+    return null;
+  }
+}
+
 // Function to find nearby volunteers based on location
 async function findNearbyVolunteers(location, maxDistance = 10) {
   try {
     console.log(`Finding volunteers for location: ${location.address}`);
     
-    // Get all available volunteers
-    const allVolunteers = await Volunteer.find({ availability: true });
-    console.log(`Total available volunteers: ${allVolunteers.length}`);
-    
-    if (!allVolunteers.length) return [];
+    // All available volunteers are only loaded when the spatial index cannot answer alone
+    let allVolunteers = null;
+    const loadAllVolunteers = async () => {
+      if (!allVolunteers) {
+        allVolunteers = await Volunteer.find({ availability: true });
+        console.log(`Total available volunteers: ${allVolunteers.length}`);
+      }
+      return allVolunteers;
+    };
 
     let matchedVolunteers = [];
     
     // First, try KNN if we have coordinates
     if (location.lat && location.lng) {
-      console.log('Using KNN algorithm for volunteer matching');
-      const volunteersWithValidLocation = allVolunteers.filter(volunteer => 
-        volunteer.location && 
-        volunteer.location.coordinates && 
-        Array.isArray(volunteer.location.coordinates) &&
-        volunteer.location.coordinates.length === 2
-      );
-
-      if (volunteersWithValidLocation.length > 0) {
-        matchedVolunteers = findKNearestNeighbors(
-          volunteersWithValidLocation,
-          { lat: location.lat, lng: location.lng }
+      const indexedVolunteers = await findIndexedNearestVolunteers(location, 5);
+      
+      if (indexedVolunteers) {
+        matchedVolunteers = indexedVolunteers;
+        console.log(`Spatial index found ${matchedVolunteers.length} nearest volunteers`);
+      } else {
+        console.log('Using KNN algorithm for volunteer matching');
+        const volunteersWithValidLocation = (await loadAllVolunteers()).filter(volunteer => 
+          volunteer.location && 
+          volunteer.location.coordinates && 
+          Array.isArray(volunteer.location.coordinates) &&
+          volunteer.location.coordinates.length === 2
         );
-        console.log(`KNN found ${matchedVolunteers.length} nearest volunteers`);
+
+        if (volunteersWithValidLocation.length > 0) {
+          matchedVolunteers = findKNearestNeighbors(
+            volunteersWithValidLocation,
+            { lat: location.lat, lng: location.lng }
+          );
+          console.log(`KNN found ${matchedVolunteers.length} nearest volunteers`);
+        }
       }
     }
     
@@ -191,7 +306,7 @@ async function findNearbyVolunteers(location, maxDistance = 10) {
       console.log('Falling back to location name matching');
       
       // Match volunteers by location name
-      const nameMatchedVolunteers = allVolunteers.filter(volunteer => {
+      const nameMatchedVolunteers = (await loadAllVolunteers()).filter(volunteer => {
         if (!volunteer.locationText || !volunteer.locationText.name) return false;
         
         const volunteerLocation = volunteer.locationText.name.toLowerCase();
@@ -440,6 +555,50 @@ async function notifyNearbyVolunteers(requestType, requestData) {
   }
 }
 
+// Within this distance two reports of one incident are treated as the same site
+const INCIDENT_SITE_RADIUS_KM = 2;
+
+// Saves a medical aid request. A unique partial index lets exactly one request per
+// incidentId be the lead, so simultaneous first reports cannot both claim it.
+// Returns the existing lead when this request is a follow-up, otherwise null.
+async function saveMedicalAid(medicalAid) {
+  if (!medicalAid.incidentId) {
+    await medicalAid.save();
+    return null;
+  }
+
+  try {
+    medicalAid.incidentLead = true;
+    await medicalAid.save();
+    return null;
+  } catch (error) {
+    if (error.code !== 11000) throw error;
+  }
+
+  const followUp = new MedicalAid({ ...medicalAid.toObject(), incidentLead: false });
+  await followUp.save();
+  medicalAid.incidentLead = false;
+  return MedicalAid.findOne({ incidentId: medicalAid.incidentId, incidentLead: true });
+}
+
+// Only precise positions can place two reports at one site. Gazetteer coordinates are
+// the centre of the named place, so two callers in the same city would always match;
+// when either report lacks a precise position, notify again rather than risk silence.
+function isSameIncidentSite(a, b) {
+  const hasPreciseCoordinates = (aid) => aid.coordinates &&
+    typeof aid.coordinates.lat === 'number' && typeof aid.coordinates.lng === 'number' &&
+    aid.coordinates.source !== 'gazetteer';
+
+  if (!hasPreciseCoordinates(a) || !hasPreciseCoordinates(b)) {
+    return false;
+  }
+
+  return calculateDistance(
+    a.coordinates.lat, a.coordinates.lng,
+    b.coordinates.lat, b.coordinates.lng
+  ) <= INCIDENT_SITE_RADIUS_KM;
+}
+
 // Routes
 app.post('/api/medical-aid', async (req, res) => {
     try {
@@ -453,14 +612,18 @@ app.post('/api/medical-aid', async (req, res) => {
             urgency: req.body.urgency,
             additionalInfo: req.body.additionalInfo,
             // Add coordinates if available
-            coordinates: req.body.coordinates || null
+            coordinates: req.body.coordinates || null,
+            // Incident cluster assigned by the speech service, if any
+            incidentId: req.body.incidentId || undefined
         });
 
-        // Save to database
-        await medicalAid.save();
+        // Save to database; the first report of an incident claims the lead slot
+        const incidentLead = await saveMedicalAid(medicalAid);
 
-        // Notify nearby volunteers
-        const notificationResult = await notifyNearbyVolunteers('medical', medicalAid);
+        // Follow-up reports of the same incident at the same place do not fan out again
+        const notificationResult = incidentLead && isSameIncidentSite(incidentLead, medicalAid)
+            ? { success: true, skipped: true, message: `Incident already reported as request ${incidentLead._id}` }
+            : await notifyNearbyVolunteers('medical', medicalAid);
         console.log('Volunteer notification result:', notificationResult);
 
         // Send response
@@ -702,6 +865,7 @@ app.post('/api/volunteers', async (req, res) => {
     
     const savedVolunteer = await volunteer.save();
     console.log('Volunteer saved:', savedVolunteer);
+    syncVolunteerIndex(savedVolunteer);
     res.status(201).json(savedVolunteer);
   } catch (error) {
     console.error('Error saving volunteer registration:', error);
@@ -746,6 +910,7 @@ app.put('/api/volunteers/:id', async (req, res) => {
       return res.status(404).json({ error: 'Volunteer not found' });
     }
     
+    syncVolunteerIndex(updatedVolunteer);
     res.json(updatedVolunteer);
   } catch (error) {
     console.error('Error updating volunteer:', error);
@@ -762,6 +927,7 @@ app.delete('/api/volunteers/:id', async (req, res) => {
       return res.status(404).json({ error: 'Volunteer not found' });
     }
     
+    syncVolunteerIndex({ _id: deletedVolunteer._id, availability: false });
     res.json({ message: 'Volunteer deleted successfully' });
   } catch (error) {
     console.error('Error deleting volunteer:', error);
@@ -1,12 +1,21 @@
 from flask import Flask, request, jsonify
 from werkzeug.utils import secure_filename
 import os
-from speech_to_text import SpeechToText
+from speech_to_text import (SpeechToText, AudioRejectedError, Deadline, DeadlineExceeded,
+                            collect_segments, detect_audio_format, filter_segments,
+                            MIN_PCM_SAMPLE_RATE, MAX_PCM_SAMPLE_RATE, MAX_PCM_CHANNELS)
+from incident_clustering import IncidentIndex
+from geo_index import Gazetteer, VolunteerIndex
+from results_store import ResultsStore, FILTER_COLUMNS
+from datetime import datetime
 import uuid
 import logging
 from flask_cors import CORS
 import traceback
 import json
+import time
+import select
+import socket
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +35,10 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Per-request processing budget; clients may ask for less (or more, up to the max)
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get('DEFAULT_DEADLINE_SECONDS', 60))
+MAX_DEADLINE_SECONDS = float(os.environ.get('MAX_DEADLINE_SECONDS', 300))
+
 # Initialize speech-to-text processor
 try:
     speech_processor = SpeechToText()
@@ -35,8 +48,47 @@ except Exception as e:
     logger.error(traceback.format_exc())
     speech_processor = None
 
+# Group repeated reports of the same emergency into one incident
+incident_index = IncidentIndex(
+    threshold=float(os.environ.get('INCIDENT_SIMILARITY', 0.4)),
+    window_seconds=int(os.environ.get('INCIDENT_WINDOW_SECONDS', 3600))
+)
+
+# Offline place lookup and in-memory index of volunteer positions
+gazetteer = Gazetteer(os.environ.get('GAZETTEER_PATH'))
+volunteer_index = VolunteerIndex()
+
+# Indexed store of every processed request, written in the background
+results_store = ResultsStore(os.environ.get('RESULTS_DB_PATH', os.path.join(UPLOAD_FOLDER, 'results.db')))
+
+def client_disconnected(environ):
+    """True once the client has closed its end of the connection"""
+    sock = environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A readable socket with nothing to read has hit EOF
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+def request_deadline():
+    """Build the Deadline for this request from X-Deadline-Ms or the server default"""
+    seconds = DEFAULT_DEADLINE_SECONDS
+    header = request.headers.get('X-Deadline-Ms')
+    if header:
+        try:
+            seconds = max(0.0, float(header) / 1000)
+        except ValueError:
+            logger.warning(f"Ignoring invalid X-Deadline-Ms header: {header}")
+    environ = request.environ
+    return Deadline(min(seconds, MAX_DEADLINE_SECONDS), lambda: client_disconnected(environ))
+
 @app.route('/api/process-audio', methods=['POST'])
 def process_audio():
+    # Start the clock before the upload is touched
+    deadline = request_deadline()
     try:
         if speech_processor is None:
             return jsonify({
@@ -65,11 +117,40 @@ def process_audio():
         logger.info(f"Received audio file: {audio_file.filename}")
         logger.info(f"Content type: {audio_file.content_type}")
         
+        # Raw PCM carries no header, so its layout has to be declared
+        sample_rate = None
+        channels = None
+        # audio/L16 is big-endian per RFC 2586; format=pcm and audio/pcm are little-endian
+        pcm_dtype = '>i2' if audio_file.mimetype == 'audio/l16' else '<i2'
+        is_raw_pcm = (request.form.get('format', '').lower() == 'pcm' or
+                      audio_file.mimetype in ('audio/l16', 'audio/pcm'))
+        if is_raw_pcm:
+            try:
+                sample_rate = int(request.form.get('sample_rate') or audio_file.mimetype_params.get('rate', 16000))
+                channels = int(request.form.get('channels') or audio_file.mimetype_params.get('channels', 1))
+            except ValueError:
+                sample_rate = channels = 0
+            if not (MIN_PCM_SAMPLE_RATE <= sample_rate <= MAX_PCM_SAMPLE_RATE and
+                    1 <= channels <= MAX_PCM_CHANNELS):
+                logger.error("Invalid sample rate or channel count for raw PCM upload")
+                return jsonify({
+                    'success': False,
+                    'message': (f'Raw PCM uploads need a sample_rate between {MIN_PCM_SAMPLE_RATE} '
+                                f'and {MAX_PCM_SAMPLE_RATE} and 1 to {MAX_PCM_CHANNELS} channels')
+                }), 400
+            extension = 'pcm'
+        else:
+            # Name the file after its real container, not the declared content type
+            header = audio_file.stream.read(16)
+            audio_file.stream.seek(0)
+            extension = detect_audio_format(header) or 'webm'
+        logger.info(f"Audio container: {extension}")
+        
         # Generate unique identifier
         file_id = str(uuid.uuid4())
         
         # Create filename with absolute path
-        filename = secure_filename(f"{file_id}.webm")
+        filename = secure_filename(f"{file_id}.{extension}")
         filepath = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename))
         
         # Save the file
@@ -97,7 +178,25 @@ def process_audio():
         # Process the audio file - just transcribe, don't extract form data
         try:
             # Preprocess and transcribe
-            processed_audio = speech_processor.preprocess_audio(filepath)
+            try:
+                processed_audio = speech_processor.preprocess_audio(
+                    filepath,
+                    sample_rate=sample_rate,
+                    channels=channels,
+                    deadline=deadline,
+                    pcm_dtype=pcm_dtype
+                )
+            except AudioRejectedError as e:
+                return jsonify({
+                    'success': False,
+                    'message': f'Audio rejected: {e.reason}',
+                    'quality': e.metrics
+                }), 422
+            except DeadlineExceeded as e:
+                return jsonify({
+                    'success': False,
+                    'message': str(e)
+                }), 499 if e.cancelled else 504
             
             if processed_audio is None:
                 logger.error("Audio preprocessing failed")
@@ -116,10 +215,33 @@ def process_audio():
                 initial_prompt="Medical emergency with patient name, condition, and location details."
             )
             
-            # Combine segments
-            transcription = " ".join([segment.text.strip() for segment in segments])
+            # Decode lazily, stopping with the segments done so far at the deadline
+            segments, partial = collect_segments(segments, deadline)
+            if deadline.cancelled():
+                logger.warning("Client disconnected, abandoning request")
+                return jsonify({
+                    'success': False,
+                    'message': 'Client disconnected'
+                }), 499
+            
+            # Combine segments, dropping silence hallucinations and repetition loops
+            transcription = " ".join([segment.text.strip() for segment in filter_segments(segments)])
             logger.info(f"Transcribed text: {transcription}")
             
+            if not transcription and partial:
+                return jsonify({
+                    'success': False,
+                    'message': 'Deadline exceeded before any speech was decoded',
+                    'partial': True
+                }), 504
+            
+            if not transcription:
+                logger.warning("No usable speech left after filtering segments")
+                return jsonify({
+                    'success': False,
+                    'message': 'Audio rejected: no intelligible speech was recognised'
+                }), 422
+            
             # Save transcription to a text file
             transcription_path = os.path.splitext(filepath)[0] + "_transcription.txt"
             with open(transcription_path, "w", encoding="utf-8") as f:
@@ -130,6 +252,10 @@ def process_audio():
             # Process the transcription separately
             result = process_transcription(transcription)
             
+            # Match against recent reports so downstream notifies once per incident
+            incident = incident_index.add_report(transcription, result)
+            result['incidentId'] = incident['cluster_id']
+            
             # Save extracted data
             data_path = os.path.splitext(filepath)[0] + "_form_data.json"
             with open(data_path, "w", encoding="utf-8") as f:
@@ -137,12 +263,16 @@ def process_audio():
                 
             logger.info(f"Saved form data to: {data_path}")
             
+            results_store.add(file_id, request_type, transcription, result)
+            
             # Return success with data
             return jsonify({
                 'success': True,
                 'message': 'Audio processed successfully',
                 'transcription': transcription,
-                'form_data': result
+                'partial': partial,
+                'form_data': result,
+                'incident': incident
             })
             
         except Exception as e:
@@ -161,6 +291,120 @@ def process_audio():
             'message': f'Server error: {str(e)}'
         }), 500
 
+@app.route('/api/volunteers/locations', methods=['POST'])
+def update_volunteer_locations():
+    """Add or move one volunteer ({id, lat, lng}) or a list of them.
+
+    In a list, invalid entries are skipped and counted so one bad record
+    does not stop a bulk load.
+    """
+    payload = request.get_json(silent=True)
+    entries = payload if isinstance(payload, list) else [payload]
+    updated = 0
+    for entry in entries:
+        try:
+            volunteer_index.upsert(str(entry['id']), float(entry['lat']), float(entry['lng']))
+            updated += 1
+        except (TypeError, KeyError, ValueError) as e:
+            logger.error(f"Invalid volunteer location entry {entry}: {str(e)}")
+
+    if not isinstance(payload, list) and not updated:
+        return jsonify({
+            'success': False,
+            'message': 'Expected {id, lat, lng} or a list of them'
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'updated': updated,
+        'rejected': len(entries) - updated,
+        'indexed': len(volunteer_index)
+    })
+
+@app.route('/api/volunteers/locations/<volunteer_id>', methods=['DELETE'])
+def remove_volunteer_location(volunteer_id):
+    if not volunteer_index.remove(volunteer_id):
+        return jsonify({
+            'success': False,
+            'message': 'Volunteer not indexed'
+        }), 404
+    return jsonify({'success': True})
+
+@app.route('/api/volunteers/nearest', methods=['GET'])
+def nearest_volunteers():
+    """k nearest volunteers to ?lat=&lng= or to a known ?location= name"""
+    try:
+        k = int(request.args.get('k', 5))
+        if not 1 <= k <= VolunteerIndex.MAX_K:
+            raise ValueError(f"k must be between 1 and {VolunteerIndex.MAX_K}")
+        max_distance = request.args.get('max_distance_km')
+        max_distance = float(max_distance) if max_distance else None
+        if max_distance is not None and not max_distance > 0:
+            raise ValueError("max_distance_km must be positive")
+        if request.args.get('lat') and request.args.get('lng'):
+            lat, lng = float(request.args['lat']), float(request.args['lng'])
+        else:
+            coordinates = gazetteer.geocode(request.args.get('location'))
+            if coordinates is None:
+                return jsonify({
+                    'success': False,
+                    'message': 'Provide lat and lng or a known location'
+                }), 400
+            lat, lng = coordinates
+        neighbours = volunteer_index.nearest(lat, lng, k=k, max_distance_km=max_distance)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid query parameters: {str(e)}'
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'target': {'lat': lat, 'lng': lng},
+        'indexed': len(volunteer_index),
+        'volunteers': [
+            {'id': volunteer_id, 'lat': v_lat, 'lng': v_lng, 'distance': round(distance, 3)}
+            for volunteer_id, v_lat, v_lng, distance in neighbours
+        ]
+    })
+
+def parse_time(value):
+    """Accept epoch seconds or an ISO 8601 timestamp"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/api/results', methods=['GET'])
+def query_results():
+    """Page through stored results filtered by type, location, condition, urgency and time"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        since = parse_time(request.args.get('since'))
+        if since is None and request.args.get('last_minutes'):
+            since = time.time() - float(request.args['last_minutes']) * 60
+        rows, next_cursor = results_store.query(
+            filters={key: request.args.get(key) for key in FILTER_COLUMNS},
+            since=since,
+            until=parse_time(request.args.get('until')),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        logger.error(f"Invalid results query: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Invalid query parameters'
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'results': rows,
+        'next_cursor': next_cursor
+    })
+
 def process_transcription(text):
     """Process transcription text and extract information"""
     logger.info(f"Processing transcription: '{text}'")
@@ -203,17 +447,17 @@ def process_transcription(text):
         "additionalInfo": text  # Keep original text for reference
     }
     
-    # Extract locations - look for common Indian cities
-    common_cities = ["hyderabad", "delhi", "mumbai", "chennai", "bangalore", "kolkata", 
-                    "pune", "ahmedabad", "jaipur", "surat", "lucknow", "kanpur", 
-                    "nagpur", "indore", "thane", "bhopal", "visakhapatnam", "patna"]
+    # Extract the location - any place the gazetteer knows, including GAZETTEER_PATH additions
+    place = gazetteer.find(text_lower)
+    if place:
+        form_data["location"] = place.title()
+        logger.info(f"Found place name: {place}")
     
-    # Look for specific city names
-    for city in common_cities:
-        if city in text_lower:
-            form_data["location"] = city.title()
-            logger.info(f"Found city name: {city}")
-            break
+    # Resolve the location offline so volunteers can be matched by distance
+    coordinates = gazetteer.geocode(form_data["location"])
+    if coordinates:
+        # Only the centre of the named place, so not precise enough to tell two sites apart
+        form_data["coordinates"] = {"lat": coordinates[0], "lng": coordinates[1], "source": "gazetteer"}
             
     # Extract patient name from common Indian names
     common_names = ["raju", "ram", "sita", "priya", "anand", "suresh", "ramesh", "sunita", 
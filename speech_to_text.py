@@ -4,14 +4,187 @@ import json
 import logging
 import numpy as np
 from scipy.io import wavfile
+from scipy.signal import resample_poly
 import soundfile as sf
+from math import gcd
 import pickle
 import re
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Whisper expects 16 kHz mono audio
+TARGET_SAMPLE_RATE = 16000
+
+# Accepted declared layouts for headerless PCM uploads
+MIN_PCM_SAMPLE_RATE = 8000
+MAX_PCM_SAMPLE_RATE = 192000
+MAX_PCM_CHANNELS = 8
+
+# Magic byte signatures of the containers we accept, checked in order
+AUDIO_SIGNATURES = [
+    ('wav', lambda header: header[:4] == b'RIFF' and header[8:12] == b'WAVE'),
+    ('webm', lambda header: header[:4] == b'\x1a\x45\xdf\xa3'),
+    ('ogg', lambda header: header[:4] == b'OggS'),
+    ('flac', lambda header: header[:4] == b'fLaC'),
+    ('mp3', lambda header: header[:3] == b'ID3' or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0)),
+    ('mp4', lambda header: header[4:8] == b'ftyp'),
+]
+
+# Pre-decode quality gate; uploads failing any of these never reach Whisper
+MIN_DURATION_SECONDS = float(os.environ.get('AUDIO_MIN_DURATION_SECONDS', 0.3))
+MIN_RMS_DBFS = float(os.environ.get('AUDIO_MIN_RMS_DBFS', -60.0))
+MAX_CLIPPING_RATIO = float(os.environ.get('AUDIO_MAX_CLIPPING_RATIO', 0.3))
+# A frame counts as speech this far above the noise floor; kept low for calls
+# made over floods, crowds and sirens
+SPEECH_MARGIN_DB = float(os.environ.get('AUDIO_SPEECH_MARGIN_DB', 6.0))
+# "No speech" needs both too few speech frames and too little level variation
+MIN_SPEECH_FRACTION = float(os.environ.get('AUDIO_MIN_SPEECH_FRACTION', 0.03))
+MIN_SNR_DB = float(os.environ.get('AUDIO_MIN_SNR_DB', 4.0))
+FRAME_SECONDS = 0.025
+
+# Post-decode segment filters, following Whisper's own no-speech heuristic
+NO_SPEECH_PROB_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+# Decoder loops run on for many words; short repeated pleas ("help help help") are real speech
+MIN_LOOP_WORDS = int(os.environ.get('MIN_LOOP_WORDS', 20))
+
+class AudioRejectedError(Exception):
+    """Raised when an upload is not worth decoding; ``reason`` is user facing"""
+
+    def __init__(self, reason, metrics=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.metrics = metrics or {}
+
+def assess_audio_quality(audio_data, sample_rate):
+    """Cheap signal statistics for mono float samples in [-1, 1]"""
+    duration = len(audio_data) / sample_rate
+    frame_length = max(1, int(sample_rate * FRAME_SECONDS))
+    frame_count = len(audio_data) // frame_length
+    frames = audio_data[:frame_count * frame_length].reshape(frame_count, frame_length)
+    
+    # Per-frame energy in dBFS; the epsilon keeps digital silence finite
+    frame_db = 10 * np.log10(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-12)
+    if frame_count:
+        noise_floor_db, speech_level_db = np.percentile(frame_db, [10, 90])
+        speech_threshold_db = max(noise_floor_db + SPEECH_MARGIN_DB, -55.0)
+        speech_fraction = float(np.mean(frame_db > speech_threshold_db))
+    else:
+        noise_floor_db = speech_level_db = -120.0
+        speech_fraction = 0.0
+    
+    rms = float(np.sqrt(np.mean(audio_data.astype(np.float64) ** 2))) if len(audio_data) else 0.0
+    return {
+        "duration": round(duration, 3),
+        "rms_dbfs": round(float(20 * np.log10(rms + 1e-12)), 2),
+        "clipping_ratio": round(float(np.mean(np.abs(audio_data) >= 0.999)) if len(audio_data) else 0.0, 4),
+        "snr_db": round(float(speech_level_db - noise_floor_db), 2),
+        "speech_fraction": round(speech_fraction, 4)
+    }
+
+def check_audio_quality(audio_data, sample_rate):
+    """Raise AudioRejectedError for uploads that cannot contain usable speech"""
+    metrics = assess_audio_quality(audio_data, sample_rate)
+    logger.info(f"Audio quality: {metrics}")
+    
+    if metrics["duration"] < MIN_DURATION_SECONDS:
+        raise AudioRejectedError("Recording is too short", metrics)
+    if metrics["rms_dbfs"] < MIN_RMS_DBFS:
+        raise AudioRejectedError("Recording is silent", metrics)
+    if metrics["clipping_ratio"] > MAX_CLIPPING_RATIO:
+        raise AudioRejectedError("Recording is too distorted (heavily clipped)", metrics)
+    if metrics["speech_fraction"] < MIN_SPEECH_FRACTION and metrics["snr_db"] < MIN_SNR_DB:
+        raise AudioRejectedError("No speech detected, only steady background noise", metrics)
+    return metrics
+
+def is_repetition_loop(segment, min_unique_ratio=0.2):
+    """Detect a decoder loop: a long segment that keeps repeating the same few words"""
+    words = re.findall(r"[a-z0-9']+", segment.text.lower())
+    if len(words) < MIN_LOOP_WORDS:
+        return False
+    return (segment.compression_ratio > COMPRESSION_RATIO_THRESHOLD or
+            len(set(words)) / len(words) < min_unique_ratio)
+
+def filter_segments(segments):
+    """Yield decoded segments that are not silence hallucinations or repetition loops"""
+    previous_text = None
+    for segment in segments:
+        text = segment.text.strip()
+        if segment.no_speech_prob > NO_SPEECH_PROB_THRESHOLD and segment.avg_logprob < LOGPROB_THRESHOLD:
+            logger.warning(f"Dropping likely non-speech segment: '{text}'")
+            continue
+        if is_repetition_loop(segment):
+            logger.warning(f"Dropping repetitive segment: '{text}'")
+            continue
+        if not text or text.lower() == previous_text:
+            continue
+        previous_text = text.lower()
+        yield segment
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of time or its client goes away"""
+
+    def __init__(self, message, cancelled=False):
+        super().__init__(message)
+        self.cancelled = cancelled
+
+class Deadline:
+    """Wall-clock budget for one request, optionally tied to a cancellation check"""
+
+    def __init__(self, seconds=None, is_cancelled=None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self._is_cancelled = is_cancelled
+
+    def remaining(self):
+        """Seconds left, or None when there is no time limit"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancelled(self):
+        return bool(self._is_cancelled and self._is_cancelled())
+
+    def expired(self):
+        return self.remaining() == 0.0 or self.cancelled()
+
+    def check(self, stage):
+        """Raise DeadlineExceeded if work on ``stage`` should not start"""
+        if self.cancelled():
+            raise DeadlineExceeded(f"Client disconnected before {stage}", cancelled=True)
+        if self.remaining() == 0.0:
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+def collect_segments(segments, deadline=None):
+    """Drain the lazy segment generator until it ends or the deadline passes.
+
+    Returns ``(segments, partial)``; ``partial`` is True when decoding was
+    stopped early and only the segments finished so far are returned.
+    """
+    collected = []
+    try:
+        for segment in segments:
+            collected.append(segment)
+            if deadline is not None and deadline.expired():
+                logger.warning(f"Stopping decode after {len(collected)} segments: "
+                               f"{'client disconnected' if deadline.cancelled() else 'deadline exceeded'}")
+                return collected, True
+    finally:
+        # Release the decoder state held by the generator
+        if hasattr(segments, 'close'):
+            segments.close()
+    return collected, False
+
+def detect_audio_format(header):
+    """Return the container name for the leading bytes of an audio file, or None"""
+    for audio_format, matches in AUDIO_SIGNATURES:
+        if matches(header):
+            return audio_format
+    return None
+
 class SpeechToText:
     _instance = None
     _model_instance = None
@@ -60,8 +233,18 @@ class SpeechToText:
         self.model = self._model_instance
         logger.info("Using cached model instance")
 
-    def preprocess_audio(self, audio_path):
-        """Preprocess audio file to improve recognition quality"""
+    def preprocess_audio(self, audio_path, sample_rate=None, channels=None, deadline=None,
+                         pcm_dtype='<i2'):
+        """Load an audio file as 16 kHz mono float32 samples ready for Whisper.
+
+        The container is sniffed from its magic bytes rather than trusted from
+        the file extension. WAV and raw PCM are read in process and only
+        resampled when the rate is not already 16 kHz; other containers are
+        decoded with soundfile, falling back to ffmpeg when it cannot.
+        Raw PCM (``.pcm``) needs the declared ``sample_rate`` and ``channels``;
+        ``pcm_dtype`` is ``'>i2'`` for big-endian audio/L16 (RFC 2586).
+        An optional ``deadline`` bounds ffmpeg and raises DeadlineExceeded.
+        """
         try:
             # Convert to absolute path and normalize separators
             audio_path = os.path.abspath(audio_path)
@@ -80,77 +263,55 @@ class SpeechToText:
                 logger.error(f"Audio file is empty: {audio_path}")
                 return None
 
-            # Convert webm to wav if needed
-            if audio_path.endswith('.webm'):
-                import subprocess
-                import shutil
-                
-                # Check if ffmpeg is installed
-                if not shutil.which('ffmpeg'):
-                    logger.error("ffmpeg is not installed or not in PATH")
-                    logger.error("Please install ffmpeg using: choco install ffmpeg")
-                    return None
-                
-                wav_path = os.path.splitext(audio_path)[0] + '.wav'
-                wav_path = os.path.normpath(wav_path)
-                try:
-                    logger.info(f"Converting webm to wav using ffmpeg...")
-                    logger.info(f"Input file: {audio_path}")
-                    logger.info(f"Output file: {wav_path}")
-                    
-                    # Use ffmpeg to convert webm to wav
-                    result = subprocess.run([
-                        'ffmpeg', '-i', audio_path,
-                        '-acodec', 'pcm_s16le',
-                        '-ar', '16000',
-                        '-ac', '1',
-                        wav_path
-                    ], check=True, capture_output=True, text=True)
-                    logger.info(f"Converted webm to wav: {wav_path}")
-                    audio_path = wav_path
-                except subprocess.CalledProcessError as e:
-                    logger.error(f"Failed to convert webm to wav: {e.stderr}")
-                    logger.error(f"ffmpeg command failed with return code: {e.returncode}")
-                    return None
-                except Exception as e:
-                    logger.error(f"Unexpected error during webm conversion: {str(e)}")
-                    return None
+            if audio_path.endswith('.pcm'):
+                audio_format = 'pcm'
+            else:
+                with open(audio_path, 'rb') as f:
+                    audio_format = detect_audio_format(f.read(16))
+            logger.info(f"Detected audio format: {audio_format}")
+            
+            if deadline is not None:
+                deadline.check("reading audio")
 
             # Read audio file
             try:
-                if audio_path.endswith('.wav'):
+                if audio_format == 'pcm':
+                    if not (MIN_PCM_SAMPLE_RATE <= (sample_rate or 0) <= MAX_PCM_SAMPLE_RATE and
+                            1 <= (channels or 0) <= MAX_PCM_CHANNELS):
+                        logger.error(f"Raw PCM upload with unsupported layout: sample_rate={sample_rate}, channels={channels}")
+                        return None
+                    audio_data = np.fromfile(audio_path, dtype=pcm_dtype)
+                    audio_data = audio_data[:len(audio_data) - len(audio_data) % channels]
+                    audio_data = audio_data.reshape(-1, channels)
+                    logger.info(f"Read raw PCM: sample_rate={sample_rate}, shape={audio_data.shape}")
+                elif audio_format == 'wav':
                     sample_rate, audio_data = wavfile.read(audio_path)
                     logger.info(f"Read WAV file: sample_rate={sample_rate}, shape={audio_data.shape}")
                 else:
-                    audio_data, sample_rate = sf.read(audio_path)
-                    logger.info(f"Read audio file: sample_rate={sample_rate}, shape={audio_data.shape}")
+                    try:
+                        audio_data, sample_rate = sf.read(audio_path, dtype='float32')
+                        logger.info(f"Read audio file: sample_rate={sample_rate}, shape={audio_data.shape}")
+                    except Exception as e:
+                        logger.info(f"soundfile cannot decode {audio_format} audio, using ffmpeg: {str(e)}")
+                        sample_rate, audio_data = self._decode_with_ffmpeg(audio_path, deadline)
+                        if audio_data is None:
+                            return None
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Failed to read audio file: {str(e)}")
                 return None
             
-            # Convert to mono if stereo
-            if len(audio_data.shape) > 1:
-                audio_data = np.mean(audio_data, axis=1)
-                logger.info(f"Converted to mono: shape={audio_data.shape}")
-            
-            # Normalize audio
-            max_val = np.max(np.abs(audio_data))
-            if max_val > 0:
-                audio_data = audio_data / max_val
-                logger.info("Audio normalized")
-            else:
-                logger.warning("Audio has zero amplitude")
+            if deadline is not None:
+                deadline.check("conditioning audio")
             
-            # Save processed audio
-            processed_path = os.path.splitext(audio_path)[0] + "_processed.wav"
-            try:
-                wavfile.write(processed_path, sample_rate, audio_data)
-                logger.info(f"Saved processed audio to: {processed_path}")
-            except Exception as e:
-                logger.error(f"Failed to save processed audio: {str(e)}")
-                return None
-            
-            return processed_path
+            return self._to_model_input(audio_data, sample_rate)
+        except AudioRejectedError as e:
+            logger.warning(f"Rejected audio {audio_path}: {e.reason}")
+            raise
+        except DeadlineExceeded as e:
+            logger.warning(f"Stopped preprocessing {audio_path}: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"Error preprocessing audio: {str(e)}")
             logger.error(f"Audio file path: {audio_path}")
@@ -158,10 +319,83 @@ class SpeechToText:
                 logger.error(f"Audio file size: {os.path.getsize(audio_path)} bytes")
             return None
 
-    def transcribe_audio(self, audio_path):
+    def _decode_with_ffmpeg(self, audio_path, deadline=None):
+        """Transcode a container soundfile cannot read into 16 kHz mono samples"""
+        import subprocess
+        import shutil
+        
+        # Check if ffmpeg is installed
+        if not shutil.which('ffmpeg'):
+            logger.error("ffmpeg is not installed or not in PATH")
+            logger.error("Please install ffmpeg using: choco install ffmpeg")
+            return None, None
+        
+        try:
+            logger.info(f"Converting {audio_path} to 16 kHz mono PCM using ffmpeg...")
+            
+            # Stream raw PCM through stdout instead of writing an intermediate wav
+            result = subprocess.run([
+                'ffmpeg', '-nostdin', '-i', audio_path,
+                '-f', 's16le',
+                '-acodec', 'pcm_s16le',
+                '-ar', str(TARGET_SAMPLE_RATE),
+                '-ac', '1',
+                '-'
+            ], check=True, capture_output=True, timeout=deadline.remaining() if deadline else None)
+            audio_data = np.frombuffer(result.stdout, dtype='<i2')
+            logger.info(f"Decoded {len(audio_data)} samples with ffmpeg")
+            return TARGET_SAMPLE_RATE, audio_data
+        except subprocess.TimeoutExpired:
+            raise DeadlineExceeded("Deadline exceeded while converting audio with ffmpeg")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to convert audio with ffmpeg: {e.stderr.decode(errors='replace')}")
+            logger.error(f"ffmpeg command failed with return code: {e.returncode}")
+            return None, None
+        except Exception as e:
+            logger.error(f"Unexpected error during ffmpeg conversion: {str(e)}")
+            return None, None
+
+    def _to_model_input(self, audio_data, sample_rate):
+        """Downmix, rescale and (only if needed) resample samples for Whisper"""
+        # Scale integer PCM to [-1, 1] floats
+        if audio_data.dtype == np.uint8:
+            audio_data = (audio_data.astype(np.float32) - 128) / 128
+        elif np.issubdtype(audio_data.dtype, np.integer):
+            audio_data = audio_data.astype(np.float32) / -float(np.iinfo(audio_data.dtype).min)
+        else:
+            audio_data = audio_data.astype(np.float32, copy=False)
+        
+        # Convert to mono if stereo
+        if audio_data.ndim > 1:
+            audio_data = audio_data.mean(axis=1) if audio_data.shape[1] > 1 else audio_data[:, 0]
+            logger.info(f"Converted to mono: shape={audio_data.shape}")
+        
+        # Reject hopeless uploads before spending anything on resampling or decoding
+        check_audio_quality(audio_data, sample_rate)
+        
+        if sample_rate != TARGET_SAMPLE_RATE:
+            divisor = gcd(int(sample_rate), TARGET_SAMPLE_RATE)
+            audio_data = resample_poly(
+                audio_data,
+                TARGET_SAMPLE_RATE // divisor,
+                int(sample_rate) // divisor
+            ).astype(np.float32)
+            logger.info(f"Resampled from {sample_rate} Hz to {TARGET_SAMPLE_RATE} Hz")
+        
+        # Normalize audio
+        max_val = np.max(np.abs(audio_data)) if audio_data.size else 0
+        if max_val > 0:
+            audio_data = audio_data / max_val
+            logger.info("Audio normalized")
+        else:
+            logger.warning("Audio has zero amplitude")
+        
+        return np.ascontiguousarray(audio_data, dtype=np.float32)
+
+    def transcribe_audio(self, audio_path, deadline=None):
         try:
             # Preprocess audio
-            processed_audio = self.preprocess_audio(audio_path)
+            processed_audio = self.preprocess_audio(audio_path, deadline=deadline)
             
             if processed_audio is None:
                 logger.error("Audio preprocessing failed")
@@ -178,8 +412,11 @@ class SpeechToText:
                 initial_prompt="Medical or transport emergency with patient name, condition, and location details. Expecting city names and medical terms."  # More specific prompt
             )
             
+            # Stop at the deadline, keeping whatever was decoded by then
+            segments, partial = collect_segments(segments, deadline)
+            
             # Combine segments with proper spacing
-            full_text = " ".join([segment.text.strip() for segment in segments])
+            full_text = " ".join([segment.text.strip() for segment in filter_segments(segments)])
             
             # Log the transcription for debugging
             logger.info(f"Transcribed text: {full_text}")
@@ -206,8 +443,11 @@ class SpeechToText:
                 "text": full_text,
                 "language": info.language,
                 "language_probability": info.language_probability,
+                "partial": partial,
                 "form_data": form_data
             }
+        except (AudioRejectedError, DeadlineExceeded):
+            return None
         except Exception as e:
             logger.error(f"Error in transcription: {str(e)}")
             logger.error(f"Audio file path: {audio_path}")
@@ -31,6 +31,9 @@ const MedicalAid = () => {
     location: /^[a-zA-Z0-9\s,.-]{5,100}$/
   };
 
+  // Fields that may be empty; the rest are required
+  const optionalFields = ['additionalInfo', 'incidentId', 'coordinates'];
+
   // Error messages
   const errorMessages = {
     patientName: 'Please enter a valid name (2-50 characters, letters only)',
@@ -110,6 +113,11 @@ const MedicalAid = () => {
         [name]: value
       };
       
+      // Coordinates resolved from a voice report no longer apply to an edited location
+      if (name === 'location') {
+        updatedFormData.coordinates = null;
+      }
+      
       // Trigger the ChatBot if condition or additionalInfo fields are updated
       // and have sufficient content to analyze
       if ((name === 'condition' || name === 'additionalInfo') && 
@@ -154,7 +162,7 @@ const MedicalAid = () => {
     
     // Check required fields and validate patterns
     Object.keys(formData).forEach(field => {
-      if (field === 'additionalInfo') return; // This field is optional
+      if (optionalFields.includes(field)) return;
       
       // Check if field is empty
       if (!formData[field]) {
@@ -244,7 +252,9 @@ const MedicalAid = () => {
       condition: formData.condition || '',
       location: formData.location || '',
       additionalInfo: formData.additionalInfo || '',
-      urgency: formData.urgency || 'high'
+      urgency: formData.urgency || 'high',
+      incidentId: formData.incidentId || '',
+      coordinates: formData.coordinates || null
     }));
 
     Swal.fire({